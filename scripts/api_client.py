@@ -22,6 +22,20 @@ from src.utils.helpers import setup_logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
+def build_api_url(host, port, endpoint="/api/analyze"):
+    """
+    Build the URL of an ECG Risk Engine API endpoint.
+    
+    Args:
+        host: API host address
+        port: API port
+        endpoint: Endpoint path
+        
+    Returns:
+        Full endpoint URL
+    """
+    return f"http://{host}:{port}{endpoint}"
+
 def main():
     """
     Main function to demonstrate how to call the ECG Risk Engine API.
@@ -39,17 +53,16 @@ def main():
         sys.exit(1)
     
     # Build API URL
-    api_url = f"http://{args.host}:{args.port}/api/analyze"
-    
-    # Prepare the file to upload
-    files = {
-        'image': (os.path.basename(args.image), open(args.image, 'rb'), 'image/jpeg')
-    }
+    api_url = build_api_url(args.host, args.port)
     
     # Make the API request
     logger.info(f"Sending request to: {api_url}")
     try:
-        response = requests.post(api_url, files=files)
+        with open(args.image, 'rb') as image_file:
+            files = {
+                'image': (os.path.basename(args.image), image_file, 'image/jpeg')
+            }
+            response = requests.post(api_url, files=files)
         response.raise_for_status()  # Raise an exception for 4XX/5XX responses
         
         # Parse the response
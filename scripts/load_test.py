@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Load generator for the ECG Risk Engine API.
+
+This script replays a directory of ECG images against the API using an async
+HTTP client with a connection pool, and reports throughput, error rate and
+latency percentiles as JSON for capacity planning and regression tracking.
+
+Two workload models are supported:
+- open: requests arrive at a fixed rate regardless of how fast the server
+  answers. Latency is measured from the scheduled send time, so queueing
+  behind a slow server is counted instead of hidden.
+- closed: a fixed number of concurrent users each send their next request as
+  soon as the previous one completes.
+"""
+
+import os
+import sys
+import math
+import time
+import json
+import random
+import asyncio
+import argparse
+import logging
+import itertools
+import httpx
+
+# Add parent directory to path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.helpers import setup_logging
+from scripts.api_client import build_api_url
+
+# Setup logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PERCENTILES = (50, 90, 99, 99.9)
+
+def load_images(image_dir):
+    """
+    Read every ECG image in a directory into memory so disk reads do not
+    affect the measured latency.
+
+    Args:
+        image_dir: Directory containing ECG images
+
+    Returns:
+        List of (filename, bytes, content type) tuples
+    """
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in IMAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(image_dir, filename), 'rb') as image_file:
+            content = image_file.read()
+        content_type = 'image/png' if extension == '.png' else 'image/jpeg'
+        images.append((filename, content, content_type))
+    return images
+
+def percentile(sorted_values, pct):
+    """
+    Compute a percentile with linear interpolation between closest ranks.
+
+    Args:
+        sorted_values: Values sorted in ascending order
+        pct: Percentile in [0, 100]
+
+    Returns:
+        The percentile value, or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+def summarize_latencies(latencies):
+    """
+    Summarize a list of latencies in seconds as milliseconds.
+
+    Args:
+        latencies: Latencies in seconds
+
+    Returns:
+        Dictionary of count, mean, max and percentiles in milliseconds
+    """
+    values = sorted(latency * 1000.0 for latency in latencies)
+    summary = {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3) if values else None,
+        "max": round(values[-1], 3) if values else None
+    }
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f"p{pct:g}"] = round(value, 3) if value is not None else None
+    return summary
+
+class LoadGenerator:
+    def __init__(self, api_url, images, warmup, duration, ramp, max_connections, timeout):
+        """
+        Initialize the load generator.
+
+        Args:
+            api_url: URL of the analyze endpoint
+            images: Images returned by load_images
+            warmup: Seconds of traffic sent before measurement starts
+            duration: Seconds of measured traffic
+            ramp: Seconds over which the load ramps up from zero to the target
+            max_connections: Size of the HTTP connection pool
+            timeout: Per-request timeout in seconds
+        """
+        self.api_url = api_url
+        self.images = itertools.cycle(images)
+        self.warmup = warmup
+        self.duration = duration
+        self.ramp = ramp
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout)
+        self.results = []
+        self.measure_start = None
+        self.measure_end = None
+
+    def _arrival_offset(self, arrivals, rate):
+        """
+        Time after start by which `arrivals` requests are due.
+
+        The rate ramps linearly from zero to `rate` over the ramp period, so
+        the expected arrival count is the integral of the rate; this inverts
+        that integral.
+
+        Args:
+            arrivals: Cumulative number of arrivals (may be fractional)
+            rate: Target arrivals per second
+
+        Returns:
+            Offset from the start in seconds
+        """
+        if self.ramp <= 0:
+            return arrivals / rate
+        ramp_arrivals = rate * self.ramp / 2.0
+        if arrivals < ramp_arrivals:
+            return math.sqrt(2.0 * self.ramp * arrivals / rate)
+        return self.ramp + (arrivals - ramp_arrivals) / rate
+
+    async def _send(self, client, scheduled):
+        """
+        Send one request and record its outcome.
+
+        Args:
+            client: The shared httpx.AsyncClient
+            scheduled: Monotonic time at which the request was due to be sent
+        """
+        filename, content, content_type = next(self.images)
+        server_time = None
+        try:
+            response = await client.post(self.api_url, files={'image': (filename, content, content_type)})
+            status = response.status_code
+            ok = status == 200
+            try:
+                server_time = response.json().get('timeTaken')
+            except ValueError:
+                pass
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+            ok = False
+        finished = time.monotonic()
+        if self.measure_start <= scheduled < self.measure_end:
+            self.results.append({
+                "client": finished - scheduled,
+                "server": server_time,
+                "status": status,
+                "ok": ok
+            })
+
+    async def run_open(self, rate, poisson=False):
+        """
+        Run an open-loop workload at a fixed arrival rate.
+
+        Args:
+            rate: Target arrivals per second
+            poisson: Use exponentially distributed inter-arrival times
+        """
+        async with httpx.AsyncClient(limits=self.limits, timeout=self.timeout) as client:
+            start = time.monotonic()
+            self.measure_start = start + self.warmup
+            self.measure_end = self.measure_start + self.duration
+            tasks = []
+            arrivals = 0.0
+            while True:
+                scheduled = start + self._arrival_offset(arrivals, rate)
+                if scheduled >= self.measure_end:
+                    break
+                now = time.monotonic()
+                if scheduled > now:
+                    await asyncio.sleep(scheduled - now)
+                tasks.append(asyncio.ensure_future(self._send(client, scheduled)))
+                # Poisson arrivals are unit-rate exponential steps in arrival count
+                arrivals += random.expovariate(1.0) if poisson else 1.0
+            await asyncio.gather(*tasks)
+
+    async def run_closed(self, concurrency):
+        """
+        Run a closed-loop workload with a fixed number of concurrent users.
+
+        Args:
+            concurrency: Number of concurrent users
+        """
+        async with httpx.AsyncClient(limits=self.limits, timeout=self.timeout) as client:
+            start = time.monotonic()
+            self.measure_start = start + self.warmup
+            self.measure_end = self.measure_start + self.duration
+
+            async def user(index):
+                # Stagger user start times across the ramp
+                await asyncio.sleep(self.ramp * index / concurrency)
+                while time.monotonic() < self.measure_end:
+                    await self._send(client, time.monotonic())
+
+            await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+    def report(self):
+        """
+        Build the JSON report for the measured window.
+
+        Returns:
+            Report dictionary
+        """
+        total = len(self.results)
+        successes = [r for r in self.results if r["ok"]]
+        errors = total - len(successes)
+        status_codes = {}
+        for r in self.results:
+            status_codes[str(r["status"])] = status_codes.get(str(r["status"]), 0) + 1
+        server_times = [r["server"] for r in successes if r["server"] is not None]
+        return {
+            "requests": total,
+            "errors": errors,
+            "errorRate": round(errors / total, 6) if total else None,
+            "throughput": round(len(successes) / self.duration, 3),
+            "statusCodes": status_codes,
+            "latencyMs": {
+                "client": summarize_latencies([r["client"] for r in successes]),
+                "server": summarize_latencies(server_times)
+            }
+        }
+
+def main():
+    """
+    Main function to run a load test against the ECG Risk Engine API.
+    """
+    parser = argparse.ArgumentParser(description="Load test the ECG Risk Engine API.")
+    parser.add_argument("--images", required=True, help="Directory of ECG images to send.")
+    parser.add_argument("--host", default="localhost", help="API host address.")
+    parser.add_argument("--port", default="8005", help="API port.")
+    parser.add_argument("--mode", choices=["open", "closed"], default="closed", help="Workload model.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrivals per second (open mode).")
+    parser.add_argument("--poisson", action="store_true", help="Use Poisson arrivals (open mode).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent users (closed mode).")
+    parser.add_argument("--warmup", type=float, default=10.0, help="Warmup seconds excluded from results.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds.")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds to ramp up to the target load.")
+    parser.add_argument("--max-connections", type=int, default=64, help="HTTP connection pool size.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+
+    args = parser.parse_args()
+
+    # Check if image directory exists
+    if not os.path.isdir(args.images):
+        logger.error(f"Image directory not found: {args.images}")
+        sys.exit(1)
+
+    images = load_images(args.images)
+    if not images:
+        logger.error(f"No ECG images found in: {args.images}")
+        sys.exit(1)
+
+    api_url = build_api_url(args.host, args.port)
+    generator = LoadGenerator(
+        api_url, images, args.warmup, args.duration, args.ramp, args.max_connections, args.timeout
+    )
+
+    logger.info(f"Running {args.mode}-loop load test against: {api_url}")
+    if args.mode == "open":
+        asyncio.run(generator.run_open(args.rate, poisson=args.poisson))
+    else:
+        asyncio.run(generator.run_closed(args.concurrency))
+
+    report = generator.report()
+    report["config"] = {
+        "url": api_url,
+        "mode": args.mode,
+        "rate": args.rate if args.mode == "open" else None,
+        "poisson": args.poisson if args.mode == "open" else None,
+        "concurrency": args.concurrency if args.mode == "closed" else None,
+        "warmup": args.warmup,
+        "duration": args.duration,
+        "ramp": args.ramp,
+        "maxConnections": args.max_connections,
+        "images": len(images)
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        logger.info(f"Report written to: {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Memory test for the ECG Risk Engine upload and LLM request path.
+
+This script pushes concurrent uploads of a given size through the same
+streaming steps /api/analyze uses (chunked upload to disk, then incremental
+base64 encoding into the Bedrock request body) and checks that peak RSS
+grows by no more than a bounded multiple of image size times concurrency.
+Bedrock is replaced by a client that waits until every request of a wave has
+its body assembled, then reads and discards it, so all bodies are in memory
+at once and no AWS access is needed.
+"""
+
+import os
+import io
+import sys
+import json
+import asyncio
+import argparse
+import logging
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.llm_model import ECGLLMAnalyzer
+from src.utils.helpers import setup_logging, stream_upload_to_file
+
+# Setup logging
+setup_logging(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+class FileUpload:
+    """
+    Minimal stand-in for FastAPI's UploadFile reading from a file on disk.
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+
+    async def read(self, size=-1):
+        # Yield like a network read so concurrent uploads interleave
+        await asyncio.sleep(0)
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+class DiscardingBedrockClient:
+    """
+    Bedrock client that holds each call until `concurrency` calls are in
+    flight, then consumes the request body in chunks and replies with a fixed
+    structured response.
+    """
+    def __init__(self, concurrency, timeout=120.0):
+        self.barrier = threading.Barrier(concurrency, timeout=timeout)
+
+    def invoke_model(self, body, modelId):
+        self.barrier.wait()
+        if hasattr(body, "read"):
+            while body.read(64 * 1024):
+                pass
+        reply = {
+            "content": [{"text": '"decision": "Normal Heartbeats", "justification": "ok"}'}],
+            "usage": {"input_tokens": 0, "output_tokens": 0}
+        }
+        return {"body": io.BytesIO(json.dumps(reply).encode("utf-8"))}
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def write_image(path, size):
+    """
+    Write `size` random bytes to `path` without holding them in memory.
+    """
+    chunk = 1024 * 1024
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(os.urandom(min(chunk, remaining)))
+            remaining -= chunk
+
+async def analyze_one(analyzer, source_path, work_dir, index):
+    """
+    Run one upload through streaming and LLM request assembly.
+    """
+    upload = FileUpload(source_path)
+    image_path = os.path.join(work_dir, f"temp_{index}.jpg")
+    try:
+        await stream_upload_to_file(upload, image_path)
+        await asyncio.to_thread(analyzer.get_analysis, None, "Normal Heartbeats", image_path)
+    finally:
+        upload.close()
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+async def run(analyzer, source_path, work_dir, concurrency, rounds):
+    """
+    Run `rounds` waves of `concurrency` concurrent requests.
+    """
+    # One thread per request so every LLM call in a wave is in flight at once
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    for round_index in range(rounds):
+        await asyncio.gather(*(
+            analyze_one(analyzer, source_path, work_dir, round_index * concurrency + i)
+            for i in range(concurrency)
+        ))
+
+def main():
+    """
+    Main function to check peak memory of the streaming analyze path.
+    """
+    parser = argparse.ArgumentParser(description="Check peak memory of the streaming analyze path.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests.")
+    parser.add_argument("--image-size-mb", type=float, default=8.0, help="Size of each uploaded image in MiB.")
+    parser.add_argument("--rounds", type=int, default=3, help="Waves of concurrent requests.")
+    parser.add_argument("--max-ratio", type=float, default=1.5,
+                        help="Allowed peak RSS growth per in-flight request, as a multiple of image size.")
+    parser.add_argument("--slack-mb", type=float, default=64.0, help="Fixed allowance for allocator and thread overhead.")
+
+    args = parser.parse_args()
+
+    image_size = int(args.image_size_mb * 1024 * 1024)
+    # Base64 inflates by 4/3 and the pooled request buffer is the only
+    # per-request copy, so anything near 1.33x per request is expected;
+    # building the body as a string costs at least twice that
+    limit = args.concurrency * image_size * args.max_ratio + args.slack_mb * 1024 * 1024
+
+    analyzer = ECGLLMAnalyzer(structured=True)
+    analyzer.bedrock_runtime = DiscardingBedrockClient(args.concurrency)
+    analyzer.max_body_buffers = args.concurrency
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, "source.jpg")
+        write_image(source_path, image_size)
+
+        baseline = peak_rss_bytes()
+        asyncio.run(run(analyzer, source_path, work_dir, args.concurrency, args.rounds))
+        growth = peak_rss_bytes() - baseline
+
+    print("\nStreaming Memory Test")
+    print("=====================")
+    print(f"Concurrency: {args.concurrency}")
+    print(f"Image size: {args.image_size_mb} MiB")
+    print(f"Peak RSS growth: {growth / (1024 * 1024):.1f} MiB")
+    print(f"Limit: {limit / (1024 * 1024):.1f} MiB")
+
+    if growth > limit:
+        logger.error("Peak RSS growth exceeded the limit")
+        sys.exit(1)
+    print("\nPASS")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Header
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+from PIL import Image
+import io
 import time
+import asyncio
+import uuid
+import hmac
 import logging
 import os
 import sys
@@ -9,8 +16,17 @@ import sys
 # Add the parent directory to the path to allow imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models.vit_model import ECGVisionTransformer
+from models.vit_model import LEAD_LAYOUTS
 from models.llm_model import ECGLLMAnalyzer
+from models.registry import ModelRegistry
+from models.signal_renderer import load_signal, render_signal, canvas_to_jpeg
+from utils.preprocess_pool import PreprocessPool
+from utils.helpers import stream_upload_to_file, read_upload, UploadTooLargeError
+from utils.binary_protocol import (
+    BATCH_CONTENT_TYPE, TENSOR_CONTENT_TYPE, BatchTooLargeError, split_frames, decode_tensor, encode_result
+)
+import base64
+import torch
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -35,20 +51,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Token required to hot-swap models; model activation is disabled when unset
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN")
+
+# Largest accepted upload for /api/analyze and /api/analyze/signal
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+
+# Allowance for multipart boundaries, part headers and small form fields
+# when comparing a request's Content-Length with MAX_UPLOAD_BYTES
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Limits for /api/infer, checked before any image is decoded
+INFER_MAX_BATCH = int(os.getenv("INFER_MAX_BATCH", 32))
+INFER_MAX_BODY_BYTES = int(os.getenv("INFER_MAX_BODY_BYTES", 32 * 1024 * 1024))
+
+# Largest decoded image accepted by /api/infer, checked from the image header
+# before any pixels are decoded; a small compressed body can still expand to
+# a huge bitmap
+INFER_MAX_IMAGE_PIXELS = int(os.getenv("INFER_MAX_IMAGE_PIXELS", 4096 * 4096))
+
+# Longest time a request waits on the preprocessing pool before falling back
+PREPROCESS_TIMEOUT = float(os.getenv("PREPROCESS_TIMEOUT", 30))
+
 # Initialize models
-vit_model = None
+model_registry = None
 llm_analyzer = None
+preprocess_pool = None
+
+def _pool_forward(pixel_values):
+    """
+    Classify a batch read from the preprocessing ring buffer.
+    
+    Args:
+        pixel_values: Float32 array of shape (N, 3, 224, 224) viewing the ring
+        
+    Returns:
+        List of (predicted label, model version) tuples
+    """
+    with model_registry.acquire() as entry:
+        logits = entry.model.predict_pixel_values(torch.from_numpy(pixel_values))
+        predicted_classes = torch.argmax(logits, dim=-1).tolist()
+        return [(entry.model.id_to_label[c], entry.version) for c in predicted_classes]
 
 @app.on_event("startup")
 async def startup_event():
     """
     Initialize models when the API starts up.
     """
-    global vit_model, llm_analyzer
+    global model_registry, llm_analyzer, preprocess_pool
     try:
-        # Initialize the Vision Transformer model
-        vit_model = ECGVisionTransformer()
-        logger.info("Vision Transformer model initialized successfully")
+        # Initialize the Vision Transformer model registry
+        model_registry = ModelRegistry()
+        model_registry.activate_initial()
+        logger.info(f"Vision Transformer model {model_registry.active_version} initialized successfully")
+        
+        # Decode and preprocess uploads in worker processes if configured
+        num_workers = int(os.getenv("PREPROCESS_WORKERS", 0))
+        if num_workers > 0:
+            with model_registry.acquire() as entry:
+                processor = entry.model.feature_extractor
+                image_size = entry.model.config.image_size
+            preprocess_pool = PreprocessPool(
+                _pool_forward,
+                num_workers=num_workers,
+                capacity=int(os.getenv("PREPROCESS_RING_CAPACITY", 64)),
+                max_batch=int(os.getenv("PREPROCESS_MAX_BATCH", 16)),
+                image_size=image_size,
+                image_mean=processor.image_mean,
+                image_std=processor.image_std,
+                rescale_factor=processor.rescale_factor
+            )
+            preprocess_pool.start()
         
         # Initialize the LLM model
         llm_analyzer = ECGLLMAnalyzer()
@@ -57,7 +130,29 @@ async def startup_event():
         logger.error(f"Error initializing models: {str(e)}")
         raise RuntimeError(f"Failed to initialize models: {str(e)}")
 
-def generate_response(response_data, status_code, status_message, start):
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop the preprocessing workers and free the shared ring buffer.
+    """
+    if preprocess_pool is not None:
+        preprocess_pool.shutdown()
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """
+    Reject uploads whose Content-Length is over the limit before the
+    multipart form is parsed and spooled to disk.
+    """
+    if request.method == "POST" and request.url.path in ("/api/analyze", "/api/analyze/signal"):
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(
+                {"detail": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit"}, status_code=413
+            )
+    return await call_next(request)
+
+def generate_response(response_data, status_code, status_message, start, model_version=None):
     """
     Generate a standardized API response.
     
@@ -66,6 +161,7 @@ def generate_response(response_data, status_code, status_message, start):
         status_code: HTTP status code
         status_message: Status message
         start: Start time for measuring execution time
+        model_version: Version of the ViT model that served the request
         
     Returns:
         Standardized response dictionary and HTTP code
@@ -74,40 +170,64 @@ def generate_response(response_data, status_code, status_message, start):
         "response": response_data,
         "status": status_message,
         "statusCode": status_code,
+        "modelVersion": model_version,
         "timeTaken": round(time.time() - start, 3)
     }
     http_code = int(status_code)
     return output_response, http_code
 
 @app.post("/api/analyze")
-async def analyze_ecg(image: UploadFile = File(...)):
+async def analyze_ecg(image: UploadFile = File(...), layout: Optional[str] = None):
     """
     Analyze an ECG image using the Vision Transformer model and LLM.
     
     Args:
         image: The uploaded ECG image file
+        layout: Optional lead-strip layout ('auto', '3x4', '6x2', '12x1') to
+            classify a multi-lead printout tile by tile
         
     Returns:
         Analysis results including decision and justification
     """
+    # Reject unknown layouts before doing any work, so a client error never
+    # reaches the LLM-only fallback
+    if layout is not None and layout != 'auto' and layout not in LEAD_LAYOUTS:
+        valid_layouts = ", ".join(['auto'] + list(LEAD_LAYOUTS))
+        raise HTTPException(status_code=400, detail=f"Unknown layout '{layout}'; expected one of: {valid_layouts}")
+    
     try:
         logger.info(f"Received file: {image.filename}")
         start = time.time()
         
-        # Save the uploaded image temporarily
-        image_path = f"temp_{image.filename}"
-        with open(image_path, "wb") as f:
-            f.write(image.file.read())
-        logger.info(f"Image saved to: {image_path}")
+        # Stream the upload to a temporary file in chunks, hashing and
+        # size-checking it on the way, instead of reading it into memory
+        image_path = f"temp_{uuid.uuid4().hex}_{os.path.basename(image.filename or 'upload')}"
+        size, digest = await stream_upload_to_file(image, image_path, MAX_UPLOAD_BYTES)
+        logger.info(f"Image saved to: {image_path} ({size} bytes, sha256 {digest})")
+        model_version = None
         
         try:
-            # Get prediction from ViT model
-            predicted_label, img = vit_model.predict(image_path)
-            image_base64 = vit_model.image_to_base64(image_path)
+            # Get prediction from the active ViT model version; a hot-swap
+            # during the request does not affect the pinned version
+            if preprocess_pool is not None and not layout:
+                future = preprocess_pool.submit(image_path)
+                predicted_label, model_version = await asyncio.wait_for(
+                    asyncio.wrap_future(future), timeout=PREPROCESS_TIMEOUT
+                )
+            else:
+                with model_registry.acquire() as entry:
+                    model_version = entry.version
+                    if layout:
+                        predicted_label, tile_labels = entry.model.predict_tiled(image_path, layout=layout)
+                        logger.info(f"Tile predictions: {tile_labels}")
+                    else:
+                        # Drop the decoded image right away
+                        predicted_label, _ = entry.model.predict(image_path)
             logger.info(f"Prediction completed: {predicted_label}")
             
-            # Get LLM justification
-            llm_response = llm_analyzer.get_analysis(image_base64, predicted_label)
+            # Get LLM justification; the image is base64-encoded straight
+            # into a reusable request buffer
+            llm_response = llm_analyzer.get_analysis(predicted_label=predicted_label, image_path=image_path)
             logger.info("LLM response received")
             
             # Prepare response
@@ -119,7 +239,7 @@ async def analyze_ecg(image: UploadFile = File(...)):
             status_code = "200"
             status_message = "Success"
             output_response, http_code = generate_response(
-                response_data, status_code, status_message, start
+                response_data, status_code, status_message, start, model_version
             )
             logger.info("API Execution completed")
             
@@ -131,11 +251,8 @@ async def analyze_ecg(image: UploadFile = File(...)):
         except Exception as e:
             logger.error(f"Error processing image with ViT model: {str(e)}")
             
-            # Fallback to LLM-only analysis
-            image_base64 = ECGVisionTransformer.image_to_base64(image_path)
-            
-            # Get LLM analysis without prediction
-            llm_response = llm_analyzer.get_analysis(image_base64)
+            # Fallback to LLM-only analysis without prediction
+            llm_response = llm_analyzer.get_analysis(image_path=image_path)
             
             response_data = {
                 "decision": llm_response.get("decision", "Unknown"),
@@ -147,7 +264,7 @@ async def analyze_ecg(image: UploadFile = File(...)):
             logger.info("Fallback LLM response received")
             
             output_response, http_code = generate_response(
-                response_data, status_code, status_message, start
+                response_data, status_code, status_message, start, model_version
             )
             
             # Clean up the temporary file
@@ -155,6 +272,10 @@ async def analyze_ecg(image: UploadFile = File(...)):
             
             return JSONResponse(output_response, status_code=http_code)
             
+    except UploadTooLargeError as e:
+        logger.error(f"Rejected upload: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    
     except Exception as e:
         logger.error(f"Failed to process the image: {str(e)}")
         
@@ -167,6 +288,156 @@ async def analyze_ecg(image: UploadFile = File(...)):
             
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
+@app.post("/api/analyze/signal")
+async def analyze_signal(signal: UploadFile = File(...), header: Optional[UploadFile] = File(None),
+                         llm: bool = True):
+    """
+    Analyze a raw multi-lead ECG recording. The samples are rendered straight
+    into the Vision Transformer's input tensor; an image is only encoded when
+    the LLM stage needs one.
+    
+    Args:
+        signal: Sample array as .npy, .csv or WFDB-style .dat
+        header: WFDB .hea header, required for .dat signals
+        llm: Whether to request an LLM justification
+        
+    Returns:
+        Analysis results including decision and justification
+    """
+    logger.info(f"Received signal: {signal.filename}")
+    start = time.time()
+    
+    try:
+        # The signal and its header share the upload limit
+        signal_bytes = await read_upload(signal, MAX_UPLOAD_BYTES)
+        header_text = None
+        if header is not None:
+            header_bytes = await read_upload(header, MAX_UPLOAD_BYTES - len(signal_bytes))
+            header_text = header_bytes.decode("utf-8")
+        samples = load_signal(signal_bytes, signal.filename, header_text)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid signal: {str(e)}")
+    
+    try:
+        with model_registry.acquire() as entry:
+            model_version = entry.version
+            predicted_label, _ = entry.model.predict_signal(samples)
+        logger.info(f"Prediction completed: {predicted_label}")
+        
+        response_data = {"decision": predicted_label}
+        if llm:
+            # Render a full-size printout for the LLM; the ViT never needs it
+            image_bytes = canvas_to_jpeg(render_signal(samples, width=1100, height=850, line_width=2))
+            image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+            llm_response = llm_analyzer.get_analysis(image_base64, predicted_label)
+            logger.info("LLM response received")
+            response_data = {
+                "decision": llm_response["decision"],
+                "justification": llm_response["justification"]
+            }
+        
+        output_response, http_code = generate_response(
+            response_data, "200", "Success", start, model_version
+        )
+        return JSONResponse(output_response, status_code=http_code)
+    
+    except Exception as e:
+        logger.error(f"Failed to process the signal: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to process the signal: {str(e)}")
+
+def _open_infer_image(frame):
+    """
+    Open an encoded image from an /api/infer body without decoding its
+    pixels, rejecting it if it is larger than INFER_MAX_IMAGE_PIXELS.
+    
+    Args:
+        frame: Encoded image bytes
+        
+    Returns:
+        The lazily loaded PIL image
+    """
+    img = Image.open(io.BytesIO(frame))
+    width, height = img.size
+    if width * height > INFER_MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Image of {width}x{height} pixels exceeds the {INFER_MAX_IMAGE_PIXELS} pixel limit"
+        )
+    return img
+
+def _infer_body(body, content_type):
+    """
+    Decode an /api/infer body and run the forward pass. Blocking; called in
+    the thread pool so it does not stall the event loop.
+    
+    Args:
+        body: Request body bytes
+        content_type: Media type of the body
+        
+    Returns:
+        Logits tensor of shape (N, num_classes) and the model version used
+    """
+    with model_registry.acquire() as entry:
+        model = entry.model
+        if content_type == TENSOR_CONTENT_TYPE:
+            pixel_values = torch.from_numpy(decode_tensor(body, model.config.image_size, INFER_MAX_BATCH))
+        elif content_type == BATCH_CONTENT_TYPE:
+            frames = split_frames(body, INFER_MAX_BATCH)
+            images = [_open_infer_image(frame) for frame in frames]
+            pixel_values = model.preprocess_images(images)
+        elif content_type.startswith("image/"):
+            pixel_values = model.preprocess_images([_open_infer_image(body)])
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+        return model.predict_pixel_values(pixel_values), entry.version
+
+@app.post("/api/infer")
+async def infer(request: Request):
+    """
+    Lean ViT-only inference for internal callers. Takes the raw request body
+    instead of a multipart form, skips the LLM stage and answers with a
+    compact binary or msgpack payload. See utils/binary_protocol.py for the
+    wire format.
+    
+    Args:
+        request: Request whose body is an image, a length-prefixed image
+            batch or a float16 tensor batch, as given by its content type
+        
+    Returns:
+        Label indices and logits for every image in the body
+    """
+    start = time.time()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    
+    # Enforce the body limit from Content-Length up front and while reading,
+    # since the header may be absent or wrong
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > INFER_MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body exceeds the {INFER_MAX_BODY_BYTES} byte limit")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > INFER_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Body exceeds the {INFER_MAX_BODY_BYTES} byte limit")
+    
+    try:
+        logits, model_version = await run_in_threadpool(_infer_body, body, content_type)
+    except BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, OSError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {str(e)}")
+    
+    labels = torch.argmax(logits, dim=-1)
+    payload, media_type = encode_result(
+        labels.numpy(), logits.numpy(), request.headers.get("accept", "")
+    )
+    headers = {
+        "X-Model-Version": str(model_version),
+        "X-Time-Taken": str(round(time.time() - start, 4))
+    }
+    return Response(content=payload, media_type=media_type, headers=headers)
+
 @app.get("/health")
 async def health_check():
     """
@@ -175,7 +446,48 @@ async def health_check():
     Returns:
         Health status of the API
     """
-    return {"status": "healthy", "models": {"vit": vit_model is not None, "llm": llm_analyzer is not None}}
+    vit_ready = model_registry is not None and model_registry.active_version is not None
+    return {
+        "status": "healthy",
+        "models": {"vit": vit_ready, "llm": llm_analyzer is not None},
+        "modelVersion": model_registry.active_version if model_registry is not None else None,
+        "preprocess": preprocess_pool.stats() if preprocess_pool is not None else None
+    }
+
+@app.get("/api/models")
+async def list_models():
+    """
+    List the model versions known to the registry.
+    
+    Returns:
+        Active, draining, loading and available model versions
+    """
+    return model_registry.status()
+
+@app.post("/api/models/{version}/activate")
+async def activate_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load a model version in the background and swap it in once it has been
+    warmed up and validated. In-flight requests finish on the old version.
+    Requires the MODEL_ADMIN_TOKEN in the X-Admin-Token header.
+    
+    Args:
+        version: Version directory name in the registry
+        x_admin_token: Admin token from the X-Admin-Token header
+        
+    Returns:
+        Acknowledgement that the activation has started
+    """
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model activation is disabled; set MODEL_ADMIN_TOKEN to enable it")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    if version != 'default' and version not in model_registry.list_versions():
+        raise HTTPException(status_code=404, detail=f"Model version not found: {version}")
+    if model_registry.activate_async(version) is None:
+        loading = ", ".join(model_registry.status()["loading"])
+        raise HTTPException(status_code=409, detail=f"Another activation is in progress: {loading}")
+    return JSONResponse({"status": "Activation started", "version": version}, status_code=202)
 
 # Run the API server if this module is executed directly
 if __name__ == "__main__":
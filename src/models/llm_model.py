@@ -1,7 +1,13 @@
+import io
 import os
+import re
+import time
 import boto3
 import json
+import binascii
 import logging
+import threading
+from collections import deque
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from dotenv import load_dotenv
@@ -9,14 +15,191 @@ from dotenv import load_dotenv
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# JSON contract for structured-output mode
+STRUCTURED_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "decision": {"type": "string"},
+        "justification": {"type": "string"},
+        "remarks": {"type": "string"}
+    },
+    "required": ["decision", "justification"]
+}
+
+# Output token budgets per predicted class in structured-output mode. Classes
+# that need more explanation get a larger budget; 'default' covers unlabelled
+# requests and unknown labels.
+DEFAULT_TOKEN_BUDGETS = {
+    'Myocardial Infarction': 400,
+    'Abnormal Heartbeats': 400,
+    'Normal Heartbeats': 200,
+    'History of MI': 350,
+    'Covid_19': 350,
+    'default': 500
+}
+
+# The reply is a single-line JSON object, so a code fence means the model has
+# moved on to text we would discard anyway. The Messages API rejects stop
+# sequences that are only whitespace, so a blank line cannot be used here.
+DEFAULT_STOP_SEQUENCES = ["```"]
+
+# Stands in for the image data in the serialized request body when the image
+# is streamed from disk; spliced out by _generate_message
+IMAGE_PLACEHOLDER = "__ECG_IMAGE_BASE64__"
+
+# Read size for incremental base64 encoding; a multiple of 3 so that no chunk
+# but the last produces padding
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+def _encode_base64_into(image_path, view):
+    """
+    Base64-encode a file chunk by chunk directly into a preallocated buffer.
+    
+    Args:
+        image_path: Path to the file to encode
+        view: Writable memoryview exactly as long as the encoded output
+    """
+    offset = 0
+    with open(image_path, "rb") as f:
+        while True:
+            chunk = f.read(BASE64_CHUNK_SIZE)
+            if not chunk:
+                break
+            encoded = binascii.b2a_base64(chunk, newline=False)
+            view[offset:offset + len(encoded)] = encoded
+            offset += len(encoded)
+
+class _MemoryviewReader(io.RawIOBase):
+    """
+    Seekable read-only file object over a memoryview, so a request body can be
+    sent from a reusable buffer without copying it into a bytes object.
+    """
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, buffer):
+        remaining = len(self._view) - self._position
+        count = min(len(buffer), remaining)
+        buffer[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = len(self._view) + offset
+        return self._position
+    
+    def tell(self):
+        return self._position
+
+def _extract_json_string(text, key):
+    """
+    Extract a string field from possibly truncated JSON text.
+    
+    Args:
+        text: JSON text, complete or cut off mid-value
+        key: Field name to extract
+        
+    Returns:
+        The field value, or None if the field has not started yet
+    """
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % re.escape(key), text)
+    if not match:
+        return None
+    raw = match.group(1)
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        # A truncated escape such as a partial \u sequence
+        return raw
+
+def parse_structured_response(text):
+    """
+    Parse a structured-output reply, tolerating replies cut off by the token
+    budget, a stop sequence or a dropped stream.
+    
+    Args:
+        text: Reply text, starting at the opening brace
+        
+    Returns:
+        Dictionary with whichever of decision, justification and remarks
+        could be recovered
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            parsed = json.loads(text[start:end + 1])
+            if isinstance(parsed, dict):
+                return {k: v for k, v in parsed.items() if k in STRUCTURED_RESPONSE_SCHEMA["properties"]}
+        except ValueError:
+            pass
+    
+    parsed = {}
+    for key in STRUCTURED_RESPONSE_SCHEMA["properties"]:
+        value = _extract_json_string(text, key)
+        if value is not None:
+            parsed[key] = value
+    return parsed
+
 class ECGLLMAnalyzer:
-    def __init__(self):
+    def __init__(self, structured=None, token_budgets=None, stop_sequences=None):
         """
         Initialize the LLM analyzer for ECG interpretations using Anthropic Claude on AWS Bedrock.
+        
+        Args:
+            structured: Use the compact JSON structured-output mode (default:
+                LLM_STRUCTURED_OUTPUT environment variable)
+            token_budgets: Per-class output token budgets for structured mode,
+                merged over DEFAULT_TOKEN_BUDGETS (default: LLM_TOKEN_BUDGETS
+                environment variable, a JSON object of class name to tokens)
+            stop_sequences: Stop sequences for structured mode
         """
         # Load environment variables
         load_dotenv()
         
+        if structured is None:
+            structured = os.getenv("LLM_STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+        self.structured = structured
+        
+        if token_budgets is None and os.getenv("LLM_TOKEN_BUDGETS"):
+            try:
+                token_budgets = json.loads(os.getenv("LLM_TOKEN_BUDGETS"))
+            except ValueError as e:
+                raise ValueError(f"LLM_TOKEN_BUDGETS is not valid JSON: {str(e)}")
+        token_budgets = token_budgets or {}
+        if not isinstance(token_budgets, dict):
+            raise ValueError("Token budgets must map class names to token counts")
+        for label, budget in token_budgets.items():
+            if isinstance(budget, bool) or not isinstance(budget, int) or budget <= 0:
+                raise ValueError(f"Token budget for '{label}' must be a positive integer, got {budget!r}")
+        self.token_budgets = dict(DEFAULT_TOKEN_BUDGETS, **token_budgets)
+        
+        stop_sequences = DEFAULT_STOP_SEQUENCES if stop_sequences is None else list(stop_sequences)
+        for sequence in stop_sequences:
+            if not isinstance(sequence, str) or not sequence.strip():
+                raise ValueError(f"Stop sequences must contain non-whitespace text, got {sequence!r}")
+        self.stop_sequences = stop_sequences
+        
+        # Per-call output token counts and latencies, for tuning budgets
+        self.call_stats = deque(maxlen=1000)
+        
+        # Request body buffers reused across calls that stream the image from disk
+        self._body_buffers = []
+        self._body_buffers_lock = threading.Lock()
+        self.max_body_buffers = 4
+        
         # Load AWS credentials
         self.aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
         self.aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
@@ -47,7 +230,60 @@ class ECGLLMAnalyzer:
             
         self.bedrock_runtime = boto3.client(**client_params)
     
-    def _generate_message(self, system_prompt, messages, max_tokens=4096):
+    def _acquire_body_buffer(self, size):
+        """
+        Take the smallest pooled buffer of at least `size` bytes, or allocate
+        one, so small requests do not pin the largest buffers.
+        """
+        with self._body_buffers_lock:
+            fits = [i for i, buffer in enumerate(self._body_buffers) if len(buffer) >= size]
+            if fits:
+                best = min(fits, key=lambda i: len(self._body_buffers[i]))
+                return self._body_buffers.pop(best)
+        return bytearray(size)
+    
+    def _release_body_buffer(self, buffer):
+        """
+        Return a buffer to the pool, keeping at most max_body_buffers. When
+        the pool is full the largest buffer is dropped, so one oversized
+        request does not stay resident.
+        """
+        with self._body_buffers_lock:
+            self._body_buffers.append(buffer)
+            if len(self._body_buffers) > self.max_body_buffers:
+                largest = max(range(len(self._body_buffers)), key=lambda i: len(self._body_buffers[i]))
+                self._body_buffers.pop(largest)
+    
+    def _invoke_with_image_file(self, body, image_path):
+        """
+        Invoke the model with the image placeholder in `body` replaced by the
+        base64 encoding of `image_path`, assembled in a pooled buffer.
+        
+        Args:
+            body: Serialized request containing IMAGE_PLACEHOLDER once
+            image_path: Path to the image to embed
+            
+        Returns:
+            Model response
+        """
+        prefix, suffix = body.encode("utf-8").split(IMAGE_PLACEHOLDER.encode("utf-8"), 1)
+        encoded_size = 4 * ((os.path.getsize(image_path) + 2) // 3)
+        total_size = len(prefix) + encoded_size + len(suffix)
+        
+        buffer = self._acquire_body_buffer(total_size)
+        view = memoryview(buffer)[:total_size]
+        try:
+            view[:len(prefix)] = prefix
+            _encode_base64_into(image_path, view[len(prefix):len(prefix) + encoded_size])
+            view[len(prefix) + encoded_size:] = suffix
+            response = self.bedrock_runtime.invoke_model(body=_MemoryviewReader(view), modelId=self.model_id)
+            return json.loads(response.get('body').read())
+        finally:
+            view.release()
+            self._release_body_buffer(buffer)
+    
+    def _generate_message(self, system_prompt, messages, max_tokens=4096, temperature=0.7,
+                          stop_sequences=None, label=None, image_path=None):
         """
         Generate a message using the Anthropic Claude model.
         
@@ -55,20 +291,46 @@ class ECGLLMAnalyzer:
             system_prompt: The system prompt to set context for the model
             messages: List of message objects to send to the model
             max_tokens: Maximum number of tokens to generate
+            temperature: Sampling temperature
+            stop_sequences: Optional sequences that end generation early
+            label: Predicted label the call is for, recorded in call_stats
+            image_path: Image to stream into the IMAGE_PLACEHOLDER of the
+                messages instead of holding its base64 string in memory
             
         Returns:
             Model response
         """
-        body = json.dumps({
+        request = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": max_tokens,
             "system": system_prompt,
             "messages": messages,
-            "temperature": 0.7
-        })
+            "temperature": temperature
+        }
+        if stop_sequences:
+            request["stop_sequences"] = stop_sequences
+        body = json.dumps(request)
+        
+        start = time.time()
+        if image_path is not None:
+            response_body = self._invoke_with_image_file(body, image_path)
+        else:
+            response = self.bedrock_runtime.invoke_model(body=body, modelId=self.model_id)
+            response_body = json.loads(response.get('body').read())
+        latency = time.time() - start
         
-        response = self.bedrock_runtime.invoke_model(body=body, modelId=self.model_id)
-        response_body = json.loads(response.get('body').read())
+        usage = response_body.get('usage', {})
+        stats = {
+            "mode": "structured" if self.structured else "freeform",
+            "label": label,
+            "maxTokens": max_tokens,
+            "inputTokens": usage.get('input_tokens'),
+            "outputTokens": usage.get('output_tokens'),
+            "stopReason": response_body.get('stop_reason'),
+            "latency": round(latency, 3)
+        }
+        self.call_stats.append(stats)
+        logger.info(f"LLM call stats: {stats}")
         return response_body
     
     def _create_prompt(self, image_base64, predicted_label=None):
@@ -121,18 +383,100 @@ class ECGLLMAnalyzer:
         
         return {"role": "user", "content": content}
     
-    def get_analysis(self, image_base64, predicted_label=None):
+    def _create_structured_prompt(self, image_base64, predicted_label, max_tokens):
+        """
+        Create a compact prompt asking for a single-line JSON reply.
+        
+        Args:
+            image_base64: Base64 encoded image
+            predicted_label: Optional predicted label from the ViT model
+            max_tokens: Output token budget, used to size the justification
+            
+        Returns:
+            Formatted prompt message
+        """
+        if predicted_label:
+            task = f"A ViT model classified this ECG as {predicted_label}. Justify that classification."
+        else:
+            task = "Classify this ECG and justify the decision."
+        # Roughly 0.6 words per token, leaving room for the JSON keys
+        word_limit = max(20, int(max_tokens * 0.6) - 30)
+        instructions = (
+            f"{task} Reply with one single-line JSON object matching this schema, and nothing else: "
+            f"{json.dumps(STRUCTURED_RESPONSE_SCHEMA, separators=(',', ':'))}. "
+            f"Keep justification under {word_limit} words."
+        )
+        return {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/jpeg",
+                        "data": image_base64
+                    }
+                },
+                {"type": "text", "text": instructions}
+            ]
+        }
+    
+    def _get_structured_analysis(self, image_base64, predicted_label=None, image_path=None):
+        """
+        Get an analysis in structured-output mode.
+        
+        Args:
+            image_base64: Base64 encoded image
+            predicted_label: Optional label from the ViT model
+            image_path: Image file to stream instead of image_base64
+            
+        Returns:
+            Dictionary containing the decision and justification
+        """
+        max_tokens = self.token_budgets.get(predicted_label, self.token_budgets['default'])
+        prompt_message = self._create_structured_prompt(image_base64, predicted_label, max_tokens)
+        # Prefill the opening brace so the reply starts inside the JSON object
+        prefill = {"role": "assistant", "content": "{"}
+        system_prompt = "You are a cardiologist. Answer only with the requested JSON."
+        
+        response = self._generate_message(
+            system_prompt, [prompt_message, prefill], max_tokens=max_tokens, temperature=0.0,
+            stop_sequences=self.stop_sequences, label=predicted_label, image_path=image_path
+        )
+        
+        if 'content' not in response or len(response['content']) == 0:
+            logger.error("Unexpected LLM API response format")
+            raise ValueError("Unexpected LLM API response format")
+        
+        response_text = "{" + response['content'][0]['text']
+        parsed = parse_structured_response(response_text)
+        if 'justification' not in parsed:
+            logger.warning("Structured response did not contain a justification")
+        return {
+            "decision": predicted_label or parsed.get("decision", "Unknown"),
+            "justification": parsed.get("justification", response_text)
+        }
+    
+    def get_analysis(self, image_base64=None, predicted_label=None, image_path=None):
         """
         Get an analysis of an ECG image from the LLM.
         
         Args:
             image_base64: Base64 encoded image
             predicted_label: Optional label from the ViT model
+            image_path: Image file to base64-encode incrementally into the
+                request body instead of passing image_base64
             
         Returns:
             Dictionary containing the decision and justification
         """
         try:
+            if image_path is not None:
+                image_base64 = IMAGE_PLACEHOLDER
+            
+            if self.structured:
+                return self._get_structured_analysis(image_base64, predicted_label, image_path)
+            
             # Create the prompt message
             prompt_message = self._create_prompt(image_base64, predicted_label)
             
@@ -140,7 +484,9 @@ class ECGLLMAnalyzer:
             system_prompt = "You are a Cardiologist and your task is to analyze an ECG image and provide a detailed report."
             
             # Generate response from model
-            response = self._generate_message(system_prompt, [prompt_message], max_tokens=4096)
+            response = self._generate_message(
+                system_prompt, [prompt_message], max_tokens=4096, label=predicted_label, image_path=image_path
+            )
             logger.info(f"LLM API Response received")
             
             # Extract text from response
@@ -0,0 +1,279 @@
+import os
+import re
+import gc
+import json
+import threading
+import logging
+from contextlib import contextmanager
+import torch
+
+from .vit_model import ECGVisionTransformer
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ModelVersion:
+    def __init__(self, version, model):
+        """
+        A loaded model version and the number of requests currently using it.
+
+        Args:
+            version: Version identifier
+            model: The loaded ECGVisionTransformer
+        """
+        self.version = version
+        self.model = model
+        self.in_flight = 0
+        self.retired = False
+
+class ModelRegistry:
+    def __init__(self, root=None, default_model_path='model.h5', default_config_path='config.json'):
+        """
+        Initialize a local registry of versioned ViT weights.
+
+        Each version lives in its own directory under the registry root and
+        holds a model.h5 and config.json, plus an optional canary.json of the
+        form {"image": "path/to/ecg.jpg", "label": "Normal Heartbeats"}.
+
+        Args:
+            root: Registry directory (default: MODEL_REGISTRY_DIR or 'model_registry')
+            default_model_path: Weights used when the registry is empty
+            default_config_path: Config used when the registry is empty
+        """
+        self.root = root or os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+        self.default_model_path = default_model_path
+        self.default_config_path = default_config_path
+
+        self._lock = threading.Lock()
+        # Held for the whole load/validate/swap so only one version is ever
+        # loading and two activations cannot race to be swapped in last
+        self._activation_lock = threading.Lock()
+        self._active = None
+        self._draining = []
+        self._loading = {}
+        self._feature_extractor = None
+
+    @staticmethod
+    def _version_key(version):
+        """
+        Natural sort key so that 'v10' sorts after 'v9'.
+        """
+        return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', version)]
+
+    def list_versions(self):
+        """
+        List the versions available in the registry.
+
+        Returns:
+            Sorted list of version identifiers
+        """
+        if not os.path.isdir(self.root):
+            return []
+        versions = [
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, 'model.h5'))
+            and os.path.isfile(os.path.join(self.root, name, 'config.json'))
+        ]
+        return sorted(versions, key=self._version_key)
+
+    def _load(self, version):
+        """
+        Load a version's weights into a new model instance.
+
+        Args:
+            version: Version identifier, or 'default' for the bundled weights
+
+        Returns:
+            The loaded ECGVisionTransformer
+        """
+        if version == 'default':
+            model_path, config_path = self.default_model_path, self.default_config_path
+        else:
+            version_dir = os.path.join(self.root, version)
+            model_path = os.path.join(version_dir, 'model.h5')
+            config_path = os.path.join(version_dir, 'config.json')
+            if not os.path.isfile(model_path) or not os.path.isfile(config_path):
+                raise ValueError(f"Model version not found in registry: {version}")
+
+        model = ECGVisionTransformer(
+            model_path=model_path,
+            config_path=config_path,
+            feature_extractor=self._feature_extractor,
+            version=version
+        )
+        # The image processor is identical across versions, so fetch it once
+        self._feature_extractor = model.feature_extractor
+        return model
+
+    def _warm_up_and_validate(self, model, version):
+        """
+        Run a warmup forward pass and, if configured, a canary prediction.
+
+        Args:
+            model: The freshly loaded model
+            version: Version identifier
+        """
+        size = model.config.image_size
+        logits = model.predict_pixel_values(torch.zeros(1, 3, size, size))
+        if logits.shape != (1, model.num_classes) or not torch.isfinite(logits).all():
+            raise ValueError(f"Model version {version} produced invalid logits during warmup")
+
+        canary_path = os.path.join(self.root, version, 'canary.json')
+        if version != 'default' and os.path.isfile(canary_path):
+            with open(canary_path, 'r') as f:
+                canary = json.load(f)
+            image_path = canary['image']
+            if not os.path.isabs(image_path):
+                image_path = os.path.join(self.root, version, image_path)
+            predicted_label, _ = model.predict(image_path)
+            expected_label = canary.get('label')
+            if expected_label and predicted_label != expected_label:
+                raise ValueError(
+                    f"Model version {version} failed canary: expected {expected_label}, got {predicted_label}"
+                )
+            logger.info(f"Model version {version} passed canary: {predicted_label}")
+
+    def activate(self, version):
+        """
+        Load, warm up and validate a version, then swap it in atomically.
+
+        Requests already running keep using the previous version, which is
+        released once they have all finished.
+
+        Args:
+            version: Version identifier, or 'default' for the bundled weights
+        """
+        with self._activation_lock:
+            logger.info(f"Loading model version {version}")
+            model = self._load(version)
+            self._warm_up_and_validate(model, version)
+
+            with self._lock:
+                previous = self._active
+                self._active = ModelVersion(version, model)
+                drained = []
+                if previous is not None:
+                    previous.retired = True
+                    self._draining.append(previous)
+                    drained = self._detach_drained()
+            logger.info(f"Model version {version} is now active")
+            self._free(drained)
+
+    def activate_async(self, version):
+        """
+        Activate a version in a background thread.
+
+        Args:
+            version: Version identifier
+
+        Returns:
+            The background thread, or None if another activation is already
+            in progress
+        """
+        with self._lock:
+            if self._loading:
+                return None
+            thread = threading.Thread(target=self._activate_in_background, args=(version,), daemon=True)
+            self._loading[version] = thread
+        thread.start()
+        return thread
+
+    def _activate_in_background(self, version):
+        """
+        Background thread body for activate_async.
+        """
+        try:
+            self.activate(version)
+        except Exception as e:
+            logger.error(f"Failed to activate model version {version}: {str(e)}")
+        finally:
+            with self._lock:
+                self._loading.pop(version, None)
+
+    def activate_initial(self):
+        """
+        Activate the version selected by MODEL_VERSION, the newest version in
+        the registry, or the bundled weights if the registry is empty.
+        """
+        versions = self.list_versions()
+        version = os.getenv("MODEL_VERSION") or (versions[-1] if versions else 'default')
+        self.activate(version)
+
+    @property
+    def active_version(self):
+        """
+        Identifier of the active version, or None if nothing is loaded.
+        """
+        active = self._active
+        return active.version if active is not None else None
+
+    @contextmanager
+    def acquire(self):
+        """
+        Pin the active version for the duration of a request.
+
+        Yields:
+            The ModelVersion to use for the request
+        """
+        with self._lock:
+            entry = self._active
+            if entry is None:
+                raise RuntimeError("No model version is active")
+            entry.in_flight += 1
+        try:
+            yield entry
+        finally:
+            drained = []
+            with self._lock:
+                entry.in_flight -= 1
+                if entry.retired:
+                    drained = self._detach_drained()
+            self._free(drained)
+
+    def _detach_drained(self):
+        """
+        Remove retired versions that no longer have requests in flight.
+        Must be called with the lock held.
+
+        Returns:
+            The detached ModelVersion entries, to be passed to _free once
+            the lock is released
+        """
+        drained = [entry for entry in self._draining if entry.in_flight == 0]
+        for entry in drained:
+            self._draining.remove(entry)
+        return drained
+
+    def _free(self, drained):
+        """
+        Drop the models of detached versions and reclaim their memory. Runs
+        without the lock so requests are not blocked behind the collection.
+        """
+        if not drained:
+            return
+        for entry in drained:
+            entry.model = None
+            logger.info(f"Released model version {entry.version}")
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def status(self):
+        """
+        Summarize the registry state.
+
+        Returns:
+            Dictionary with the active, draining, loading and available versions
+        """
+        # Read the registry directory before taking the lock
+        available = self.list_versions()
+        with self._lock:
+            return {
+                "active": self._active.version if self._active is not None else None,
+                "draining": [
+                    {"version": entry.version, "inFlight": entry.in_flight}
+                    for entry in self._draining
+                ],
+                "loading": list(self._loading),
+                "available": available
+            }
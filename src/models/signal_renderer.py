@@ -0,0 +1,213 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+
+# WFDB formats supported by the binary loader, mapped to their sample dtype
+WFDB_FORMATS = {
+    '16': '<i2',
+    '80': 'u1',
+}
+
+# Largest number of leads the renderer lays out legibly
+MAX_LEADS = 16
+
+def load_signal(content, filename, header=None):
+    """
+    Load a multi-lead ECG recording from raw file content.
+
+    Supported inputs are NumPy .npy arrays, CSV files with one column per
+    lead (an optional header row is skipped), and WFDB-style binary .dat
+    files in format 16 or 80 together with their .hea header.
+
+    Args:
+        content: Raw file bytes
+        filename: Original file name, used to pick the format
+        header: WFDB header text, required for .dat files
+
+    Returns:
+        Float32 array of shape (num_leads, num_samples)
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.npy':
+        try:
+            signal = np.load(io.BytesIO(content), allow_pickle=False)
+        except (EOFError, OSError) as e:
+            raise ValueError(f"Invalid .npy file: {str(e)}")
+    elif extension == '.csv':
+        text = content.decode('utf-8')
+        try:
+            signal = np.loadtxt(io.StringIO(text), delimiter=',', ndmin=2)
+        except ValueError:
+            signal = np.loadtxt(io.StringIO(text), delimiter=',', ndmin=2, skiprows=1)
+    elif extension == '.dat':
+        if header is None:
+            raise ValueError("WFDB .dat signals require a .hea header")
+        return _load_wfdb(content, header)
+    else:
+        raise ValueError(f"Unsupported signal format: {extension}")
+
+    signal = np.asarray(signal, dtype=np.float32)
+    if signal.ndim == 1:
+        signal = signal[np.newaxis, :]
+    if signal.ndim != 2:
+        raise ValueError(f"Expected a 2D signal array, got shape {signal.shape}")
+    # Recordings are far longer than they are wide, so put leads first
+    if signal.shape[0] > signal.shape[1]:
+        signal = signal.T
+    return _validate_signal(np.ascontiguousarray(signal))
+
+def _validate_signal(signal):
+    """
+    Check that a loaded recording can be rendered.
+
+    Args:
+        signal: Array of shape (num_leads, num_samples)
+
+    Returns:
+        The same array
+    """
+    num_leads, num_samples = signal.shape
+    if not 1 <= num_leads <= MAX_LEADS:
+        raise ValueError(f"Expected 1 to {MAX_LEADS} leads, got {num_leads}")
+    if num_samples < 2:
+        raise ValueError(f"Expected at least 2 samples per lead, got {num_samples}")
+    if not np.isfinite(signal).all():
+        raise ValueError("Signal contains NaN or infinite values")
+    return signal
+
+def _load_wfdb(content, header):
+    """
+    Decode a WFDB binary signal file using its header.
+
+    Args:
+        content: Raw .dat bytes
+        header: Text of the matching .hea file
+
+    Returns:
+        Float32 array of shape (num_leads, num_samples) in physical units
+    """
+    lines = [line.strip() for line in header.splitlines() if line.strip() and not line.strip().startswith('#')]
+    if not lines:
+        raise ValueError("WFDB header is empty")
+    record = lines[0].split()
+    if len(record) < 2:
+        raise ValueError("WFDB record line must give the record name and number of signals")
+    num_leads = int(record[1])
+    if not 1 <= num_leads <= MAX_LEADS:
+        raise ValueError(f"Expected 1 to {MAX_LEADS} leads, got {num_leads}")
+    signal_lines = [line.split() for line in lines[1:1 + num_leads]]
+    if len(signal_lines) < num_leads:
+        raise ValueError(f"WFDB header declares {num_leads} signals but describes {len(signal_lines)}")
+    if any(len(fields) < 2 for fields in signal_lines):
+        raise ValueError("WFDB signal lines must give the file name and format")
+
+    formats = {fields[1].split('x')[0].split(':')[0].split('+')[0] for fields in signal_lines}
+    if len(formats) != 1 or next(iter(formats)) not in WFDB_FORMATS:
+        raise ValueError(f"Unsupported WFDB format: {', '.join(sorted(formats))}")
+    fmt = formats.pop()
+
+    gains = np.empty(num_leads, dtype=np.float32)
+    baselines = np.zeros(num_leads, dtype=np.float32)
+    for i, fields in enumerate(signal_lines):
+        gain_field = fields[2] if len(fields) > 2 else '200'
+        gain = gain_field.split('/')[0]
+        if '(' in gain:
+            gain, baseline = gain.rstrip(')').split('(')
+            baselines[i] = float(baseline)
+        gains[i] = float(gain) or 200.0
+
+    samples = np.frombuffer(content, dtype=WFDB_FORMATS[fmt])
+    if fmt == '80':
+        samples = samples.astype(np.int16) - 128
+    samples = samples[:len(samples) - len(samples) % num_leads].reshape(-1, num_leads)
+    signal = (samples.astype(np.float32) - baselines) / gains
+    return _validate_signal(np.ascontiguousarray(signal.T))
+
+def render_signal(signal, width=224, height=224, cols=4, line_width=1):
+    """
+    Draw a multi-lead recording as a printout-style grayscale image.
+
+    Leads are laid out column-major on a grid like a standard 12-lead page:
+    with 12 leads and 4 columns, each column shows three leads over the next
+    quarter of the recording. Drawing is vectorized over all leads at once.
+
+    Args:
+        signal: Array of shape (num_leads, num_samples)
+        width: Output width in pixels
+        height: Output height in pixels
+        cols: Number of lead columns
+        line_width: Trace thickness in pixels
+
+    Returns:
+        Uint8 array of shape (height, width), black trace on white
+    """
+    num_leads, num_samples = signal.shape
+    cols = max(1, min(cols, num_leads))
+    rows = -(-num_leads // cols)
+    cell_height, cell_width = height // rows, width // cols
+
+    # Each column shows its own consecutive segment of the recording
+    lead_index = np.arange(num_leads)
+    lead_col = lead_index // rows
+    lead_row = lead_index % rows
+    segment = num_samples / float(cols)
+    positions = lead_col[:, None] * segment + np.linspace(0, segment - 1, cell_width + 1)[None, :]
+    positions = np.clip(positions, 0, num_samples - 1)
+
+    # Linear interpolation of every lead onto its pixel columns
+    left = np.floor(positions).astype(np.int64)
+    right = np.minimum(left + 1, num_samples - 1)
+    frac = (positions - left).astype(np.float32)
+    values = signal[lead_index[:, None], left] * (1 - frac) + signal[lead_index[:, None], right] * frac
+
+    # Center each lead and share one amplitude scale so relative sizes survive
+    values = values - np.median(values, axis=1, keepdims=True)
+    scale = np.abs(values).max() or 1.0
+    y = (cell_height - 1) / 2.0 * (1 - 0.9 * values / scale)
+
+    # Connect consecutive points with vertical runs between their y values
+    lo = np.minimum(y[:, :-1], y[:, 1:]) - (line_width - 1) / 2.0
+    hi = np.maximum(y[:, :-1], y[:, 1:]) + (line_width - 1) / 2.0
+    pixel_rows = np.arange(cell_height, dtype=np.float32)[None, :, None]
+    traces = (pixel_rows >= np.floor(lo)[:, None, :]) & (pixel_rows <= np.ceil(hi)[:, None, :])
+
+    grid = np.zeros((rows, cols, cell_height, cell_width), dtype=bool)
+    grid[lead_row, lead_col] = traces
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    drawn = grid.transpose(0, 2, 1, 3).reshape(rows * cell_height, cols * cell_width)
+    canvas[:rows * cell_height, :cols * cell_width][drawn] = 0
+    return canvas
+
+def canvas_to_pixel_values(canvas, image_mean, image_std, rescale_factor=1 / 255):
+    """
+    Convert a rendered grayscale canvas to the ViT's normalized input layout.
+
+    Args:
+        canvas: Uint8 array of shape (height, width)
+        image_mean: Per-channel mean of the image processor
+        image_std: Per-channel standard deviation of the image processor
+        rescale_factor: Pixel rescale factor of the image processor
+
+    Returns:
+        Float32 array of shape (3, height, width)
+    """
+    gray = canvas.astype(np.float32) * rescale_factor
+    mean = np.asarray(image_mean, dtype=np.float32)[:, None, None]
+    std = np.asarray(image_std, dtype=np.float32)[:, None, None]
+    return (gray[None, :, :] - mean) / std
+
+def canvas_to_jpeg(canvas, quality=90):
+    """
+    Encode a rendered canvas as JPEG, for when an image is actually needed.
+
+    Args:
+        canvas: Uint8 array of shape (height, width)
+        quality: JPEG quality
+
+    Returns:
+        JPEG bytes
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(canvas).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
@@ -1,19 +1,38 @@
 from transformers import ViTForImageClassification, ViTConfig, ViTImageProcessor
 import torch
+import numpy as np
 from PIL import Image
 import base64
 import h5py
 import os
 
+from .signal_renderer import render_signal, canvas_to_pixel_values
+
+# Lead-strip layouts for multi-lead ECG printouts. Each layout splits the box
+# (left, top, right, bottom as fractions of the page) into a rows x cols grid
+# of lead strips, read row-major.
+LEAD_LAYOUTS = {
+    # Standard 12-lead page: 3 rows of 4 leads with a rhythm strip below
+    '3x4': {'rows': 3, 'cols': 4, 'box': (0.0, 0.0, 1.0, 0.75)},
+    # Two columns of 6 leads
+    '6x2': {'rows': 6, 'cols': 2, 'box': (0.0, 0.0, 1.0, 1.0)},
+    # One lead per row
+    '12x1': {'rows': 12, 'cols': 1, 'box': (0.0, 0.0, 1.0, 1.0)},
+}
+
 class ECGVisionTransformer:
-    def __init__(self, model_path='model.h5', config_path='config.json'):
+    def __init__(self, model_path='model.h5', config_path='config.json', feature_extractor=None, version=None):
         """
         Initialize the Vision Transformer model for ECG classification.
         
         Args:
             model_path: Path to the model weights file
             config_path: Path to the model configuration file
+            feature_extractor: Optional image processor to reuse instead of
+                fetching it again
+            version: Optional version identifier of the loaded weights
         """
+        self.version = version
         self.num_classes = 5
         self.config = ViTConfig.from_pretrained(config_path)
         self.config.num_labels = self.num_classes
@@ -21,9 +40,10 @@ class ECGVisionTransformer:
         
         # Load the model weights
         self.load_model_from_h5(self.model, model_path)
+        self.model.eval()
         
         # Initialize the feature extractor
-        self.feature_extractor = ViTImageProcessor.from_pretrained('google/vit-base-patch16-224')
+        self.feature_extractor = feature_extractor or ViTImageProcessor.from_pretrained('google/vit-base-patch16-224')
         
         # Define the mapping from class index to label
         self.id_to_label = {
@@ -59,13 +79,179 @@ class ECGVisionTransformer:
         """
         img = Image.open(image_path)
         inputs = self.feature_extractor(images=img, return_tensors="pt")
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits = outputs.logits
-            predicted_class = torch.argmax(logits, dim=-1).item()
+        logits = self.predict_pixel_values(inputs['pixel_values'])
+        predicted_class = torch.argmax(logits, dim=-1).item()
         predicted_label = self.id_to_label[predicted_class]
         return predicted_label, img
 
+    def preprocess_images(self, images):
+        """
+        Preprocess a batch of decoded images in one feature extractor call.
+        
+        Args:
+            images: List of PIL images
+            
+        Returns:
+            Normalized tensor of shape (N, 3, 224, 224)
+        """
+        images = [img.convert('RGB') for img in images]
+        inputs = self.feature_extractor(images=images, return_tensors="pt")
+        return inputs['pixel_values']
+
+    def predict_pixel_values(self, pixel_values):
+        """
+        Run a forward pass on a batch of preprocessed images.
+        
+        Args:
+            pixel_values: Normalized tensor of shape (N, 3, 224, 224)
+            
+        Returns:
+            Logits tensor of shape (N, num_classes)
+        """
+        with torch.no_grad():
+            outputs = self.model(pixel_values=pixel_values)
+        return outputs.logits
+
+    def predict_signal(self, signal, cols=4):
+        """
+        Make a prediction on a raw multi-lead ECG recording by rendering it
+        straight into the model's input tensor, without image encoding.
+        
+        Args:
+            signal: Array of shape (num_leads, num_samples)
+            cols: Number of lead columns in the rendered layout
+            
+        Returns:
+            predicted_label: The predicted label for the ECG
+            canvas: The rendered grayscale canvas
+        """
+        size = self.config.image_size
+        canvas = render_signal(signal, width=size, height=size, cols=cols)
+        pixel_values = canvas_to_pixel_values(
+            canvas,
+            self.feature_extractor.image_mean,
+            self.feature_extractor.image_std,
+            self.feature_extractor.rescale_factor
+        )
+        logits = self.predict_pixel_values(torch.from_numpy(pixel_values).unsqueeze(0))
+        predicted_class = torch.argmax(logits, dim=-1).item()
+        predicted_label = self.id_to_label[predicted_class]
+        return predicted_label, canvas
+
+    @staticmethod
+    def detect_layout(width, height):
+        """
+        Pick a lead-strip layout from the page aspect ratio.
+        
+        Args:
+            width: Page width in pixels
+            height: Page height in pixels
+            
+        Returns:
+            Name of a layout in LEAD_LAYOUTS
+        """
+        aspect = width / float(height)
+        if aspect >= 1.2:
+            return '3x4'
+        if aspect <= 0.5:
+            return '12x1'
+        return '6x2'
+
+    def predict_tiled(self, image_path, layout='auto', aggregation='mean'):
+        """
+        Make a page-level prediction on a multi-lead ECG printout by
+        classifying each lead strip and aggregating the per-tile logits.
+        
+        All tiles are cut from a single resize of the page and run through
+        the model as one batch.
+        
+        Args:
+            image_path: Path to the input ECG image
+            layout: Name of a layout in LEAD_LAYOUTS, a layout dict with
+                'rows', 'cols' and 'box' keys, or 'auto' to detect it
+            aggregation: How to combine tile logits ('mean', 'max' or 'vote')
+            
+        Returns:
+            predicted_label: The page-level predicted label
+            tile_labels: The predicted label of each tile, row-major
+        """
+        img = Image.open(image_path)
+        if layout == 'auto':
+            layout = self.detect_layout(*img.size)
+        if isinstance(layout, str):
+            if layout not in LEAD_LAYOUTS:
+                raise ValueError(f"Unknown lead layout: {layout}")
+            layout = LEAD_LAYOUTS[layout]
+        rows, cols = layout['rows'], layout['cols']
+        left, top, right, bottom = layout['box']
+        size = self.config.image_size
+        
+        # Let the JPEG decoder downscale while decoding, keeping just enough
+        # resolution for the grid; a no-op for other formats
+        grid_width, grid_height = cols * size, rows * size
+        img.draft('RGB', (int(grid_width / (right - left)), int(grid_height / (bottom - top))))
+        img = img.convert('RGB')
+        
+        page_width, page_height = img.size
+        crop_box = (
+            int(left * page_width), int(top * page_height),
+            int(right * page_width), int(bottom * page_height)
+        )
+        grid = img.crop(crop_box).resize((grid_width, grid_height), Image.BILINEAR)
+        
+        pixel_values = self._grid_to_tiles(np.array(grid), rows, cols)
+        tile_logits = self.predict_pixel_values(pixel_values)
+        page_logits = self.aggregate_logits(tile_logits, aggregation)
+        
+        predicted_class = torch.argmax(page_logits).item()
+        tile_classes = torch.argmax(tile_logits, dim=-1).tolist()
+        predicted_label = self.id_to_label[predicted_class]
+        tile_labels = [self.id_to_label[c] for c in tile_classes]
+        return predicted_label, tile_labels
+
+    def _grid_to_tiles(self, grid, rows, cols):
+        """
+        Split a (rows*S, cols*S, 3) uint8 grid into normalized tiles.
+        
+        Args:
+            grid: Resized lead grid as a uint8 array
+            rows: Number of tile rows
+            cols: Number of tile columns
+            
+        Returns:
+            Normalized tensor of shape (rows*cols, 3, S, S)
+        """
+        size = self.config.image_size
+        tiles = torch.from_numpy(grid).view(rows, size, cols, size, 3)
+        tiles = tiles.permute(0, 2, 4, 1, 3).reshape(rows * cols, 3, size, size)
+        tiles = tiles.float().mul_(self.feature_extractor.rescale_factor)
+        mean = torch.tensor(self.feature_extractor.image_mean).view(1, 3, 1, 1)
+        std = torch.tensor(self.feature_extractor.image_std).view(1, 3, 1, 1)
+        return tiles.sub_(mean).div_(std)
+
+    @staticmethod
+    def aggregate_logits(tile_logits, aggregation='mean'):
+        """
+        Combine per-tile logits into page-level logits.
+        
+        Args:
+            tile_logits: Tensor of shape (num_tiles, num_classes)
+            aggregation: 'mean' of logits, per-class 'max', or majority 'vote'
+                with ties broken by mean logits
+            
+        Returns:
+            Tensor of shape (num_classes,)
+        """
+        if aggregation == 'mean':
+            return tile_logits.mean(dim=0)
+        if aggregation == 'max':
+            return tile_logits.max(dim=0).values
+        if aggregation == 'vote':
+            votes = torch.bincount(tile_logits.argmax(dim=-1), minlength=tile_logits.shape[-1])
+            tie_break = torch.softmax(tile_logits.mean(dim=0), dim=-1)
+            return votes.float() + tie_break
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+
     @staticmethod
     def image_to_base64(image_path):
         """
@@ -0,0 +1,141 @@
+"""
+Compact wire format for the internal ViT-only inference endpoint.
+
+Request bodies are sent raw with one of these content types:
+- image/jpeg, image/png: a single encoded image
+- application/x-ecg-batch: several encoded images, each prefixed with its
+  length as a little-endian uint32
+- application/x-ecg-tensor-f16: preprocessed little-endian float16 tensors
+  of shape (N, 3, 224, 224)
+
+Responses are msgpack maps when the caller accepts application/msgpack and
+msgpack is installed, otherwise application/x-ecg-result: a little-endian
+header of (num_images, num_classes) as uint32, then num_images int32 label
+indices, then num_images * num_classes float32 logits.
+"""
+
+import struct
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BATCH_CONTENT_TYPE = "application/x-ecg-batch"
+TENSOR_CONTENT_TYPE = "application/x-ecg-tensor-f16"
+RESULT_CONTENT_TYPE = "application/x-ecg-result"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+_FRAME_HEADER = struct.Struct("<I")
+_RESULT_HEADER = struct.Struct("<II")
+
+class BatchTooLargeError(ValueError):
+    """
+    Raised when a request body holds more images than allowed.
+    """
+
+def split_frames(body, max_frames=None):
+    """
+    Split a length-prefixed batch body into individual image payloads.
+
+    Args:
+        body: Request body bytes
+        max_frames: Maximum number of images accepted (optional)
+
+    Returns:
+        List of memoryviews, one per image
+    """
+    view = memoryview(body)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if offset + _FRAME_HEADER.size > len(view):
+            raise ValueError("Truncated frame header")
+        (length,) = _FRAME_HEADER.unpack_from(view, offset)
+        offset += _FRAME_HEADER.size
+        if offset + length > len(view):
+            raise ValueError("Truncated frame payload")
+        frames.append(view[offset:offset + length])
+        offset += length
+        if max_frames is not None and len(frames) > max_frames:
+            raise BatchTooLargeError(f"Batch holds more than {max_frames} images")
+    if not frames:
+        raise ValueError("Empty batch")
+    return frames
+
+def join_frames(payloads):
+    """
+    Build a length-prefixed batch body from image payloads.
+
+    Args:
+        payloads: Iterable of encoded image bytes
+
+    Returns:
+        Batch body bytes
+    """
+    parts = []
+    for payload in payloads:
+        parts.append(_FRAME_HEADER.pack(len(payload)))
+        parts.append(bytes(payload))
+    return b"".join(parts)
+
+def decode_tensor(body, image_size=224, max_images=None):
+    """
+    Decode a float16 tensor body into a float32 array for the model.
+
+    Args:
+        body: Request body bytes
+        image_size: Model input height and width
+        max_images: Maximum number of images accepted (optional)
+
+    Returns:
+        Float32 array of shape (N, 3, image_size, image_size)
+    """
+    per_image = 3 * image_size * image_size * 2
+    if not body or len(body) % per_image:
+        raise ValueError(f"Tensor body must be a multiple of {per_image} bytes")
+    if max_images is not None and len(body) // per_image > max_images:
+        raise BatchTooLargeError(f"Batch holds more than {max_images} images")
+    tensor = np.frombuffer(body, dtype="<f2").reshape(-1, 3, image_size, image_size)
+    return tensor.astype(np.float32)
+
+def encode_result(labels, logits, accept=""):
+    """
+    Encode label indices and logits for the response.
+
+    Args:
+        labels: Int array of shape (N,)
+        logits: Float array of shape (N, num_classes)
+        accept: Accept header of the request
+
+    Returns:
+        Payload bytes and content type
+    """
+    labels = np.ascontiguousarray(labels, dtype="<i4")
+    logits = np.ascontiguousarray(logits, dtype="<f4")
+    if msgpack is not None and MSGPACK_CONTENT_TYPE in accept:
+        payload = msgpack.packb({
+            "labels": labels.tolist(),
+            "logits": logits.tolist()
+        })
+        return payload, MSGPACK_CONTENT_TYPE
+    header = _RESULT_HEADER.pack(logits.shape[0], logits.shape[1])
+    return header + labels.tobytes() + logits.tobytes(), RESULT_CONTENT_TYPE
+
+def decode_result(payload):
+    """
+    Decode an application/x-ecg-result payload.
+
+    Args:
+        payload: Response body bytes
+
+    Returns:
+        Int32 label array of shape (N,) and float32 logits of shape (N, num_classes)
+    """
+    num_images, num_classes = _RESULT_HEADER.unpack_from(payload, 0)
+    offset = _RESULT_HEADER.size
+    labels = np.frombuffer(payload, dtype="<i4", count=num_images, offset=offset)
+    offset += num_images * 4
+    logits = np.frombuffer(payload, dtype="<f4", count=num_images * num_classes, offset=offset)
+    return labels, logits.reshape(num_images, num_classes)
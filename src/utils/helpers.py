@@ -1,11 +1,17 @@
 import os
 import base64
+import hashlib
 import logging
 from PIL import Image
 import tempfile
 
 logger = logging.getLogger(__name__)
 
+class UploadTooLargeError(ValueError):
+    """
+    Raised when an upload exceeds the configured size limit.
+    """
+
 def setup_logging(level=logging.INFO):
     """
     Set up logging configuration.
@@ -84,6 +90,62 @@ def save_temp_file(file_content, prefix="temp_", suffix=".jpg"):
         logger.error(f"Error saving temporary file: {str(e)}")
         raise
 
+async def stream_upload_to_file(upload, output_path, max_bytes=None, chunk_size=1024 * 1024):
+    """
+    Stream an uploaded file to disk in chunks, hashing it and enforcing a
+    size limit as it arrives, so the whole upload is never held in memory.
+    
+    Args:
+        upload: FastAPI UploadFile to read from
+        output_path: Path to write the upload to
+        max_bytes: Maximum accepted size in bytes (optional)
+        chunk_size: Number of bytes to read at a time
+        
+    Returns:
+        Size of the upload in bytes and its SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(output_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return size, digest.hexdigest()
+
+async def read_upload(upload, max_bytes=None, chunk_size=1024 * 1024):
+    """
+    Read an uploaded file into memory in chunks, enforcing a size limit as it
+    arrives so an oversized upload is rejected without being read in full.
+    
+    Args:
+        upload: FastAPI UploadFile to read from
+        max_bytes: Maximum accepted size in bytes (optional)
+        chunk_size: Number of bytes to read at a time
+        
+    Returns:
+        The upload contents as bytes
+    """
+    data = bytearray()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        data += chunk
+        if max_bytes is not None and len(data) > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+    return bytes(data)
+
 def clean_temp_files(directory=None, prefix="temp_"):
     """
     Clean up temporary files in a directory.
@@ -0,0 +1,387 @@
+"""
+Multi-process image preprocessing for the Vision Transformer.
+
+Decoding and resizing uploads in worker processes keeps that work off the
+GIL shared with request handling and the torch forward pass. Workers write
+normalized 3x224x224 float32 tensors into a preallocated shared-memory ring
+buffer; only slot indices travel through queues, so tensors are never
+pickled. A single inference thread collects ready slots into batches, hands
+them to the model as views on the ring and returns the slots to the pool.
+"""
+
+import io
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class SharedTensorRing:
+    def __init__(self, capacity, shape=(3, 224, 224), name=None):
+        """
+        A fixed number of float32 tensor slots in shared memory.
+
+        Args:
+            capacity: Number of slots
+            shape: Shape of one tensor
+            name: Name of an existing ring to attach to; a new one is
+                created when omitted
+        """
+        self.capacity = capacity
+        self.shape = tuple(shape)
+        size = capacity * int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.array = np.ndarray((capacity,) + self.shape, dtype=np.float32, buffer=self.shm.buf)
+
+    def batch(self, slots):
+        """
+        Get the tensors in the given slots as one (N, *shape) array.
+
+        Args:
+            slots: Sorted slot indices
+
+        Returns:
+            A view on the ring when the slots are contiguous, otherwise a
+            gathered copy
+        """
+        first = slots[0]
+        if slots[-1] - first == len(slots) - 1:
+            return self.array[first:first + len(slots)]
+        return self.array[slots]
+
+    def close(self):
+        """
+        Detach from the shared memory.
+        """
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Free the shared memory. Only the creating process should call this.
+        """
+        self.shm.unlink()
+
+def _worker_main(worker_index, ring_name, capacity, shape, image_mean, image_std, rescale_factor,
+                 task_queue, ready_queue, free_slots, stall_seconds, worker_tasks):
+    """
+    Worker process loop: decode, resize and normalize images into ring slots.
+
+    Tasks are (task_id, source) tuples where source is a file path or image
+    bytes. Results are (task_id, slot, error) tuples on the ready queue. The
+    task being handled is published in worker_tasks[worker_index] so the
+    parent knows which image was in hand if this process dies.
+    """
+    ring = SharedTensorRing(capacity, shape, name=ring_name)
+    size = (shape[2], shape[1])
+    mean = np.asarray(image_mean, dtype=np.float32)
+    std = np.asarray(image_std, dtype=np.float32)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            task_id, source = task
+            worker_tasks[worker_index] = task_id
+            try:
+                if isinstance(source, (bytes, bytearray)):
+                    source = io.BytesIO(source)
+                with Image.open(source) as img:
+                    pixels = np.asarray(img.convert('RGB').resize(size, Image.BILINEAR), dtype=np.float32)
+            except Exception as e:
+                ready_queue.put((task_id, None, str(e)))
+                worker_tasks[worker_index] = -1
+                continue
+
+            # Wait for a free slot; time spent here means inference is behind
+            wait_start = time.monotonic()
+            slot = free_slots.get()
+            waited = time.monotonic() - wait_start
+            if waited > 0.001:
+                with stall_seconds.get_lock():
+                    stall_seconds.value += waited
+
+            np.multiply(pixels, rescale_factor, out=pixels)
+            np.subtract(pixels, mean, out=pixels)
+            np.divide(pixels, std, out=pixels)
+            ring.array[slot] = pixels.transpose(2, 0, 1)
+            ready_queue.put((task_id, slot, None))
+            worker_tasks[worker_index] = -1
+    finally:
+        ring.close()
+
+class PreprocessPool:
+    # A worker that dies within this many seconds of starting counts towards
+    # a crash loop; after max_quick_deaths in a row the pool gives up
+    min_worker_uptime = 5.0
+    max_quick_deaths = 3
+
+    def __init__(self, forward_fn, num_workers=2, capacity=64, max_batch=16, image_size=224,
+                 image_mean=(0.5, 0.5, 0.5), image_std=(0.5, 0.5, 0.5), rescale_factor=1 / 255):
+        """
+        Initialize the preprocessing pool.
+
+        Args:
+            forward_fn: Called from the inference thread with a float32 array
+                of shape (N, 3, S, S) that views the ring; must return one
+                result per image and must not keep the array
+            num_workers: Number of preprocessing processes
+            capacity: Number of tensor slots in the ring buffer
+            max_batch: Maximum number of images per forward call
+            image_size: Model input height and width
+            image_mean: Per-channel normalization mean
+            image_std: Per-channel normalization standard deviation
+            rescale_factor: Pixel rescale factor applied before normalization
+        """
+        self.forward_fn = forward_fn
+        self.num_workers = num_workers
+        self.capacity = capacity
+        self.max_batch = max_batch
+        self.shape = (3, image_size, image_size)
+        self.image_mean = tuple(image_mean)
+        self.image_std = tuple(image_std)
+        self.rescale_factor = rescale_factor
+
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_task_id = 0
+        self._running = False
+        self._broken = None
+        self._quick_deaths = 0
+        self._worker_restarts = 0
+        self._inference_stall = 0.0
+        self._batches = 0
+        self._images = 0
+
+    def start(self):
+        """
+        Allocate the ring buffer and start the worker processes and the
+        inference thread.
+        """
+        self._ctx = multiprocessing.get_context("spawn")
+        self.ring = SharedTensorRing(self.capacity, self.shape)
+        self._start_workers()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._inference_loop, daemon=True)
+        self._thread.start()
+        logger.info(f"Started {self.num_workers} preprocessing workers with {self.capacity} ring slots")
+
+    def _start_workers(self):
+        """
+        Create fresh queues with every ring slot free and start the worker
+        processes. Must not be called while a batch is being run.
+        """
+        ctx = self._ctx
+        stalled = self._worker_stall.value if hasattr(self, "_worker_stall") else 0.0
+        self._task_queue = ctx.Queue()
+        self._ready_queue = ctx.Queue()
+        self._free_slots = ctx.Queue()
+        for slot in range(self.capacity):
+            self._free_slots.put(slot)
+        self._worker_stall = ctx.Value('d', stalled)
+        self._worker_tasks = ctx.Array('q', [-1] * self.num_workers, lock=False)
+
+        self._workers = [
+            ctx.Process(
+                target=_worker_main,
+                args=(i, self.ring.name, self.capacity, self.shape, self.image_mean, self.image_std,
+                      self.rescale_factor, self._task_queue, self._ready_queue, self._free_slots,
+                      self._worker_stall, self._worker_tasks),
+                daemon=True
+            )
+            for i in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._workers_started = time.monotonic()
+
+    def _check_workers(self):
+        """
+        Recover from a dead worker process.
+
+        A worker killed mid-task may still hold a queue lock, so the queues
+        cannot be reused: every worker is stopped and restarted on fresh
+        queues, the image the dead worker was handling fails, and all other
+        pending images are queued again. If workers keep dying right after
+        starting, every pending image fails and the pool stops accepting work.
+        """
+        dead = [i for i, worker in enumerate(self._workers) if not worker.is_alive()]
+        if not dead:
+            return
+        for i in dead:
+            logger.error(f"Preprocessing worker {i} exited with code {self._workers[i].exitcode}")
+        in_hand = {self._worker_tasks[i] for i in dead}
+
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join(timeout=5)
+        for old_queue in (self._task_queue, self._ready_queue, self._free_slots):
+            old_queue.cancel_join_thread()
+            old_queue.close()
+
+        if time.monotonic() - self._workers_started < self.min_worker_uptime:
+            self._quick_deaths += 1
+        else:
+            self._quick_deaths = 0
+        if self._quick_deaths >= self.max_quick_deaths:
+            self._broken = "preprocessing workers keep exiting"
+            logger.error(f"Preprocessing pool disabled: {self._broken}")
+            self._fail_pending(RuntimeError(f"Preprocessing pool failed: {self._broken}"))
+            return
+
+        with self._pending_lock:
+            lost = [self._pending.pop(task_id) for task_id in in_hand if task_id in self._pending]
+            self._start_workers()
+            for task_id, (_, source) in self._pending.items():
+                self._task_queue.put((task_id, source))
+        for future, _ in lost:
+            self._resolve(future, error=RuntimeError("Preprocessing worker died while handling the image"))
+        self._worker_restarts += 1
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        """
+        Complete a future unless it is missing or was cancelled by a caller
+        that stopped waiting.
+        """
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail_pending(self, error):
+        """
+        Fail every future still waiting for a result.
+        """
+        with self._pending_lock:
+            futures = [future for future, _ in self._pending.values()]
+            self._pending.clear()
+        for future in futures:
+            self._resolve(future, error=error)
+
+    def submit(self, source):
+        """
+        Queue an image for preprocessing and inference.
+
+        Args:
+            source: Image file path or encoded image bytes
+
+        Returns:
+            Future resolving to this image's result from forward_fn
+        """
+        if self._broken:
+            raise RuntimeError(f"Preprocessing pool failed: {self._broken}")
+        future = Future()
+        with self._pending_lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            # The source is kept so the task can be queued again if the
+            # worker pool has to be restarted
+            self._pending[task_id] = (future, source)
+            self._task_queue.put((task_id, source))
+        return future
+
+    def _inference_loop(self):
+        """
+        Collect ready slots into batches and run forward_fn on them.
+        """
+        while self._running:
+            self._check_workers()
+            if self._broken:
+                return
+            wait_start = time.monotonic()
+            try:
+                ready = [self._ready_queue.get(timeout=0.1)]
+            except queue.Empty:
+                ready = []
+            with self._pending_lock:
+                has_pending = bool(self._pending)
+            if has_pending:
+                # Time spent waiting while work is queued means preprocessing is behind
+                self._inference_stall += time.monotonic() - wait_start
+            if not ready:
+                continue
+            while len(ready) < self.max_batch:
+                try:
+                    ready.append(self._ready_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self._pending_lock:
+                futures = {task_id: self._pending.pop(task_id, (None, None))[0] for task_id, _, _ in ready}
+            batch = []
+            for task_id, slot, error in ready:
+                if error is not None:
+                    self._resolve(futures[task_id], error=ValueError(f"Failed to preprocess image: {error}"))
+                else:
+                    batch.append((slot, task_id))
+            if not batch:
+                continue
+
+            batch.sort()
+            slots = [slot for slot, _ in batch]
+            try:
+                results = self.forward_fn(self.ring.batch(slots))
+            except Exception as e:
+                for _, task_id in batch:
+                    self._resolve(futures[task_id], error=e)
+            else:
+                for i, (_, task_id) in enumerate(batch):
+                    self._resolve(futures[task_id], result=results[i])
+                self._batches += 1
+                self._images += len(batch)
+            finally:
+                for slot in slots:
+                    self._free_slots.put(slot)
+
+    def stats(self):
+        """
+        Summarize pool configuration and stall times.
+
+        Returns:
+            Dictionary of pool statistics
+        """
+        return {
+            "workers": self.num_workers,
+            "workersAlive": sum(worker.is_alive() for worker in self._workers),
+            "workerRestarts": self._worker_restarts,
+            "failed": self._broken,
+            "ringCapacity": self.capacity,
+            "batches": self._batches,
+            "images": self._images,
+            "workerStallSeconds": round(self._worker_stall.value, 3),
+            "inferenceStallSeconds": round(self._inference_stall, 3)
+        }
+
+    def shutdown(self):
+        """
+        Stop the workers and the inference thread and free the ring buffer.
+        """
+        # Stop the inference thread first so it does not restart exiting workers
+        self._running = False
+        self._thread.join(timeout=5)
+        if not self._broken:
+            for _ in self._workers:
+                self._task_queue.put(None)
+            for worker in self._workers:
+                worker.join(timeout=5)
+        with self._pending_lock:
+            for future, _ in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self.ring.close()
+        self.ring.unlink()